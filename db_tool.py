@@ -0,0 +1,196 @@
+"""Потоковая выгрузка, загрузка и проверка базы пользователей HealCo.
+
+    python db_tool.py export users.ndjson.gz
+    python db_tool.py import users.ndjson.gz --store my_storage:users
+    python db_tool.py verify users.ndjson.gz
+
+Хранилище — любой объект с интерфейсом словаря «строка -> JSON-строка», заданный как модуль:атрибут
+(по умолчанию replit:db). Ключи читаются префиксными блоками через store.prefix(), если он есть.
+"""
+import argparse
+import datetime
+import gzip
+import hashlib
+import importlib
+import itertools
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+DB_IO_WORKERS = 8
+DB_IO_CHUNK_SIZE = 200
+DEFAULT_STORE = "replit:db"
+
+logger = logging.getLogger(__name__)
+
+
+def iter_user_ids(store, after: str = None):
+    """Идентификаторы пользователей в лексикографическом порядке — для курсора рассылки.
+
+    Каждый префиксный блок ключей сортируется целиком; для массового чтения есть iter_raw_users.
+    """
+    if not hasattr(store, "prefix"):
+        yield from sorted(key for key in store.keys() if key.isdigit() and (after is None or key > after))
+        return
+    for prefix in "123456789":
+        if after and prefix < after[0]:
+            continue
+        for key in sorted(store.prefix(prefix)):
+            if key.isdigit() and (after is None or key > after):
+                yield key
+
+def iter_unordered_user_ids(store):
+    if not hasattr(store, "prefix"):
+        yield from (key for key in store.keys() if key.isdigit())
+        return
+    for prefix in "123456789":
+        yield from (key for key in store.prefix(prefix) if key.isdigit())
+
+def iter_raw_users(store, workers: int = DB_IO_WORKERS, chunk_size: int = DB_IO_CHUNK_SIZE):
+    """Пары (user_id, значение из хранилища) без сортировки; записи читаются пачками по chunk_size в workers потоков."""
+    user_ids = iter_unordered_user_ids(store)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while chunk := list(itertools.islice(user_ids, chunk_size)):
+            yield from zip(chunk, executor.map(store.get, chunk))
+
+def iter_users_data(store, workers: int = DB_IO_WORKERS, chunk_size: int = DB_IO_CHUNK_SIZE):
+    """Пары (user_id, data) по всему хранилищу; записи, которые не разбираются как JSON, пропускаются с предупреждением."""
+    for user_id, raw in iter_raw_users(store, workers, chunk_size):
+        try:
+            yield user_id, json.loads(raw)
+        except (json.JSONDecodeError, TypeError):
+            logger.warning(f"Запись пользователя {user_id} не разбирается как JSON и пропущена.")
+
+def open_ndjson(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def iter_ndjson_chunks(path: str, chunk_size: int = DB_IO_CHUNK_SIZE):
+    with open_ndjson(path, "r") as f:
+        lines = (line.rstrip("\n") for line in f)
+        while chunk := list(itertools.islice(lines, chunk_size)):
+            yield chunk
+
+def export_users(store, path: str, workers: int = DB_IO_WORKERS) -> dict:
+    """Построчно пишет всех пользователей в NDJSON (.gz — со сжатием) и манифест с числом записей и sha256.
+
+    Записи, которые не разбираются как JSON, выгружаются как есть в поле raw и учитываются в манифесте как invalid.
+    """
+    digest = hashlib.sha256()
+    count = 0
+    invalid = 0
+    with open_ndjson(path, "w") as f:
+        for user_id, raw in iter_raw_users(store, workers):
+            try:
+                record = {"id": user_id, "data": json.loads(raw)}
+            except (json.JSONDecodeError, TypeError):
+                logger.warning(f"Запись пользователя {user_id} не разбирается как JSON и выгружена как есть.")
+                record = {"id": user_id, "raw": raw}
+                invalid += 1
+            line = json.dumps(record, ensure_ascii=False, sort_keys=True)
+            f.write(line + "\n")
+            digest.update(line.encode("utf-8"))
+            count += 1
+    manifest = {"count": count, "invalid": invalid, "sha256": digest.hexdigest(), "exported_at": datetime.datetime.now().isoformat()}
+    with open(path + ".manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return manifest
+
+def check_export_manifest(path: str):
+    manifest_path = path + ".manifest.json"
+    if not os.path.exists(manifest_path):
+        return
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    digest = hashlib.sha256()
+    count = 0
+    for chunk in iter_ndjson_chunks(path):
+        for line in chunk:
+            digest.update(line.encode("utf-8"))
+            count += 1
+    if count != manifest["count"] or digest.hexdigest() != manifest["sha256"]:
+        raise ValueError(f"Файл {path} не совпадает с манифестом: {count} записей вместо {manifest['count']} или другая контрольная сумма.")
+
+def stored_value(record: dict):
+    return record["raw"] if "raw" in record else json.dumps(record["data"])
+
+def import_users(store, path: str, workers: int = DB_IO_WORKERS, resume: bool = True) -> int:
+    """Загружает выгрузку в store.
+
+    Номер последней записанной строки сохраняется в path.progress после каждой пачки,
+    так что прерванная загрузка продолжается с того же места.
+    """
+    check_export_manifest(path)
+    progress_path = path + ".progress"
+    done = 0
+    if resume and os.path.exists(progress_path):
+        with open(progress_path, encoding="utf-8") as f:
+            done = int(f.read() or 0)
+    line_no = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in iter_ndjson_chunks(path):
+            line_no += len(chunk)
+            if line_no <= done:
+                continue
+            records = [json.loads(line) for line in chunk[max(0, done - (line_no - len(chunk))):]]
+            list(executor.map(lambda record: store.__setitem__(record["id"], stored_value(record)), records))
+            with open(progress_path, "w", encoding="utf-8") as f:
+                f.write(str(line_no))
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    return line_no
+
+def verify_import(store, path: str, workers: int = DB_IO_WORKERS) -> int:
+    """Сверяет каждую запись выгрузки с хранилищем; возвращает число расхождений."""
+    mismatches = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in iter_ndjson_chunks(path):
+            records = [json.loads(line) for line in chunk]
+            for record, raw in zip(records, executor.map(lambda record: store.get(record["id"]), records)):
+                if "raw" in record:
+                    matches = raw == record["raw"]
+                else:
+                    try:
+                        matches = json.loads(raw) == record["data"]
+                    except (json.JSONDecodeError, TypeError):
+                        matches = False
+                if not matches:
+                    mismatches += 1
+                    logger.warning(f"Расхождение в записи пользователя {record['id']}.")
+    return mismatches
+
+def load_store(spec: str):
+    module_name, _, attribute = spec.partition(":")
+    store = getattr(importlib.import_module(module_name), attribute or "db")
+    if store is None:
+        raise ValueError(f"Хранилище {spec} не настроено.")
+    return store
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Выгрузка, загрузка и проверка базы пользователей.")
+    parser.add_argument("command", choices=["export", "import", "verify"])
+    parser.add_argument("path", help="файл NDJSON; с расширением .gz — сжатый")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="хранилище в виде модуль:атрибут, по умолчанию replit:db")
+    parser.add_argument("--workers", type=int, default=DB_IO_WORKERS)
+    parser.add_argument("--restart", action="store_true", help="начать загрузку заново, игнорируя сохраненный прогресс")
+    args = parser.parse_args(argv)
+    store = load_store(args.store)
+
+    if args.command == "export":
+        manifest = export_users(store, args.path, args.workers)
+        logger.info(f"Выгружено {manifest['count']} пользователей в {args.path} (из них {manifest['invalid']} не в формате JSON), sha256 {manifest['sha256']}.")
+    elif args.command == "import":
+        count = import_users(store, args.path, workers=args.workers, resume=not args.restart)
+        logger.info(f"Загружено {count} пользователей из {args.path}.")
+    else:
+        mismatches = verify_import(store, args.path, workers=args.workers)
+        logger.info(f"Проверка {args.path}: расхождений {mismatches}.")
+        if mismatches:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    main()
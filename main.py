@@ -1,13 +1,22 @@
 import logging
 import os
 import asyncio
+import heapq
+import itertools
+import time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputFile
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.ext import Application, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes, ConversationHandler
 import openai
+import tiktoken
 import base64
+import functools
 import json
 import re
 from replit import db
+from PIL import Image
+from db_tool import iter_user_ids, iter_users_data
 import datetime
 from io import BytesIO
 
@@ -15,10 +24,12 @@ from io import BytesIO
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+ADMIN_USER_IDS = {int(uid) for uid in os.getenv("ADMIN_USER_IDS", "").split(",") if uid.strip().isdigit()}
+
 if not TELEGRAM_BOT_TOKEN or not OPENAI_API_KEY:
     raise ValueError("Ключи TELEGRAM_BOT_TOKEN или OPENAI_API_KEY не найдены в Secrets!")
 
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
@@ -46,7 +57,7 @@ ROLE_KEYBOARD = ReplyKeyboardMarkup(ROLE_BUTTONS, one_time_keyboard=True, resize
 NUTRITIONIST_KEYBOARD = ReplyKeyboardMarkup([["Рассчитать КБЖУ 📊", "Составить меню на день 🍽️"], ["Задать вопрос нутрициологу ❓"], ["⬅️ Назад к выбору специалиста"]], resize_keyboard=True)
 FITNESS_TRAINER_KEYBOARD = ReplyKeyboardMarkup([["Составить план тренировок 💪"], ["Рассчитать ИМТ 📉", "Что такое VO2max ❓"], ["Обновить данные профиля 🔄", "Вопрос по тренажеру 🏋️"], ["Задать вопрос тренеру ❓"], ["⬅️ Назад к выбору специалиста"]], resize_keyboard=True)
 PSYCHOTHERAPIST_KEYBOARD = ReplyKeyboardMarkup([["Дневник настроения 🧠"], ["Техника дыхания для успокоения 🌬️"], ["Задать вопрос психотерапевту ❓"], ["⬅️ Назад к выбору специалиста"]], resize_keyboard=True)
-FUTURE_SELF_KEYBOARD = ReplyKeyboardMarkup([["Создать мое спортивное будущее 🔮"], ["⬅️ Назад к выбору специалиста"]], resize_keyboard=True)
+FUTURE_SELF_KEYBOARD = ReplyKeyboardMarkup([["Создать мое спортивное будущее 🔮"], ["Забыть мое фото 🗑️"], ["⬅️ Назад к выбору специалиста"]], resize_keyboard=True)
 GENERAL_SPECIALIST_KEYBOARD = ReplyKeyboardMarkup([["Задать вопрос специалисту ❓"], ["⬅️ Назад к выбору специалиста"]], resize_keyboard=True)
 
 DIARIES_KEYBOARD = ReplyKeyboardMarkup([["Дневник питания 🥕", "Дневник тренировок 🏋️"], ["Дневник здоровья ❤️‍🩹", "Дневник настроения 📊"], ["⬅️ Назад в главное меню"]], resize_keyboard=True)
@@ -65,6 +76,48 @@ GENDER, AGE, HEIGHT, WEIGHT, ACTIVITY, GOAL, DISEASES, ALLERGIES = range(8)
 LOCATION, EQUIPMENT = range(2)
 MOOD_SELECT, TIME_SELECT = range(2)
 
+# --- Лимит исходящих сообщений ---
+# Общий бюджет на все сообщения бота, ниже лимита Telegram ~30/с. Ответы на входящие обновления
+# списываются из него же, а рассылка берет токен, только если после этого в ведре остается запас.
+TELEGRAM_SEND_RATE = 25
+BROADCAST_RESERVE_TOKENS = 10
+
+# --- Настройки напоминаний ---
+DEFAULT_TIMEZONE = "Europe/Moscow"
+DEFAULT_QUIET_HOURS = [22, 8]
+PROFILE_STALE_DAYS = 30
+PROFILE_REMINDER_REPEAT_DAYS = 7
+PROFILE_REMINDER_HOUR = 12
+MOOD_REMINDER_HOUR = 20
+STREAK_REMINDER_HOUR = 19
+REMINDER_KINDS = ("profile", "mood", "streak")
+# Размер пачки ограничивает работу за тик; скорость отправки задает общий send_limiter.
+REMINDER_TICK_SECONDS = 10
+REMINDER_BATCH_SIZE = 250
+REMINDER_RETRY_SECONDS = 300
+
+# --- Настройки рассылки ---
+BROADCAST_CHUNK_SIZE = 100
+BROADCAST_MAX_RETRIES = 3
+BROADCAST_STATE_KEY = "broadcast_state"
+
+# --- Настройки диалога со специалистом ---
+# Входной промпт ограничен: роль + сводка + последние реплики + новое сообщение.
+CHAT_MODEL = "gpt-4o"
+CHAT_HISTORY_TOKEN_BUDGET = 1500
+CHAT_HISTORY_KEEP_TOKENS = 700
+CHAT_SUMMARY_MAX_TOKENS = 300
+CHAT_MESSAGE_MAX_TOKENS = 1000
+CHAT_REPLY_MAX_TOKENS = 700
+
+# --- Настройки кэша описаний лица ---
+FACE_CACHE_TTL_DAYS = 30
+FACE_CACHE_MAX_ENTRIES = 5
+# Максимальное число различающихся бит 64-битного dHash, при котором фото считаются одинаковыми.
+FACE_HASH_MAX_DISTANCE = 6
+# Начала ответов, которыми vision-модель отказывается описывать фото; такие ответы не кэшируются и не уходят в DALL-E.
+FACE_DESCRIPTION_REFUSALS = ("i'm sorry", "i am sorry", "i can't", "i cannot", "i'm unable", "i am unable", "sorry", "извини", "к сожалению", "я не могу", "не могу")
+
 
 # --- Функции для работы с базой данных ---
 def get_user_data_from_db(user_id):
@@ -76,7 +129,9 @@ def get_user_data_from_db(user_id):
             data = {}
     else:
         data = {}
+    return fill_user_data_defaults(data)
 
+def fill_user_data_defaults(data: dict) -> dict:
     data.setdefault("profile_data", {}).setdefault("last_updated", None)
     data.setdefault("workout_diary", [])
     data.setdefault("health_diary", [])
@@ -84,27 +139,66 @@ def get_user_data_from_db(user_id):
     data.setdefault("food_diary", [])
     data.setdefault("score", 0)
     data.setdefault("first_name", "")
+    data.setdefault("chat_history", {})
+    data.setdefault("face_cache", [])
+    reminders = data.setdefault("reminders", {})
+    reminders.setdefault("enabled", True)
+    reminders.setdefault("timezone", DEFAULT_TIMEZONE)
+    reminders.setdefault("quiet_hours", list(DEFAULT_QUIET_HOURS))
+    reminders.setdefault("last_sent", {})
     return data
 
 def save_user_data_to_db(user_id, data):
     key = str(user_id)
     db[key] = json.dumps(data)
 
-def get_all_users_data():
-    all_data = {}
-    user_ids = db.keys()
-    for user_id in user_ids:
-        try:
-            if user_id.isdigit():
-                all_data[user_id] = json.loads(db[user_id])
-        except (json.JSONDecodeError, TypeError):
-            continue
-    return all_data
-
 # --- Вспомогательные функции ---
 def encode_image(image_bytes):
     return base64.b64encode(image_bytes).decode('utf-8')
 
+class TokenBucket:
+    """Ограничитель частоты: в среднем не больше rate отправок в секунду, всплески до capacity."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def consume(self, tokens: float = 1):
+        """Списывает токены без ожидания — для ответов на входящие обновления, которые не должны ждать."""
+        self._refill()
+        self._tokens = max(self._tokens - tokens, -self.capacity)
+
+    def pause(self, seconds: float):
+        # После RetryAfter токены уходят в минус, и все отправители ждут, пока лимит не восстановится.
+        # Одновременные паузы перекрываются: ожидание равно самой длинной из них, а не сумме.
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate)
+
+    async def acquire(self, reserve: float = 0):
+        """Ждет токен; с reserve берет его, только если в ведре останется еще reserve токенов."""
+        while True:
+            self._refill()
+            if self._tokens >= 1 + reserve:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 + reserve - self._tokens) / self.rate)
+
+send_limiter = TokenBucket(TELEGRAM_SEND_RATE)
+
+async def count_interactive_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    send_limiter.consume()
+
+def get_retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, datetime.timedelta) else retry_after
+
 def get_personal_prompt(user_profile_data: dict, first_name: str = None) -> str:
     if not user_profile_data or not user_profile_data.get('goal'):
         return "У пользователя не заполнен профиль. Попроси его заполнить профиль для получения персонализированных рекомендаций. "
@@ -122,20 +216,21 @@ def get_personal_prompt(user_profile_data: dict, first_name: str = None) -> str:
         parts.append(f"аллергии: {user_profile_data['allergies']}")
     return f"Учитывай в ответе, что пользователь сообщил о себе: {', '.join(parts)}. " if parts else ""
 
-async def check_profile_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    data = get_user_data_from_db(user_id)
+PROFILE_UPDATE_REMINDER_TEXT = (
+    "🗓️ Я заметил, что ты давно не обновлял данные своего профиля. "
+    "Твой вес или уровень активности могли измениться. "
+    "Чтобы мои рекомендации оставались точными, советую обновить профиль. "
+    "Это можно сделать в меню Фитнес-тренера."
+)
+
+async def check_profile_update(update: Update, context: ContextTypes.DEFAULT_TYPE, data: dict = None):
+    if data is None:
+        data = get_user_data_from_db(update.effective_user.id)
     last_updated_str = data.get("profile_data", {}).get("last_updated")
     if last_updated_str:
         last_updated_date = datetime.datetime.strptime(last_updated_str, '%Y-%m-%d').date()
-        if (datetime.date.today() - last_updated_date).days > 30:
-            await update.message.reply_text(
-                "🗓️ Я заметил, что ты давно не обновлял данные своего профиля. "
-                "Твой вес или уровень активности могли измениться. "
-                "Чтобы мои рекомендации оставались точными, советую обновить профиль. "
-                "Это можно сделать в меню Фитнес-тренера.",
-                reply_markup=MAIN_MENU_KEYBOARD
-            )
+        if (datetime.date.today() - last_updated_date).days > PROFILE_STALE_DAYS:
+            await update.message.reply_text(PROFILE_UPDATE_REMINDER_TEXT, reply_markup=MAIN_MENU_KEYBOARD)
             return False
     return True
 
@@ -144,7 +239,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     data = get_user_data_from_db(user.id)
     data["first_name"] = user.first_name
+    data.pop('context_state', None)
     save_user_data_to_db(user.id, data)
+    schedule_user_reminders(user.id, data)
     keyboard = MAIN_MENU_KEYBOARD if data.get("profile_data", {}).get('goal') else START_KEYBOARD
     await update.message.reply_text(
         f"Привет, {user.mention_html()}! 👋\n\n"
@@ -165,26 +262,32 @@ async def show_diaries_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text("🏆 Собираю данные для таблицы лидеров...")
-    all_users_data = get_all_users_data()
-    valid_users = [
+    valid_users = (
         (data.get('first_name', 'Аноним'), data.get('score', 0))
-        for uid, data in all_users_data.items()
+        for uid, data in iter_users_data(db)
         if data.get('score', 0) > 0 and data.get('first_name')
-    ]
-    sorted_users = sorted(valid_users, key=lambda x: x[1], reverse=True)
+    )
+    sorted_users = heapq.nlargest(10, valid_users, key=lambda x: x[1])
     
     if not sorted_users:
         await update.message.reply_text("Пока никто не набрал баллов. Будь первым!")
         return
         
     response_text = "🏆 <b>Топ-10 пользователей:</b>\n\n"
-    for i, (name, score) in enumerate(sorted_users[:10], 1):
+    for i, (name, score) in enumerate(sorted_users, 1):
         medals = {1: "🥇", 2: "🥈", 3: "🥉"}
         response_text += f"{medals.get(i, f'<b>{i}.</b>')} {name} - {score} баллов\n"
         
     await update.message.reply_text(response_text, parse_mode='HTML')
 
 # --- Логика Ролей-Специалистов ---
+def get_role_keyboard(role: str) -> ReplyKeyboardMarkup:
+    if role == "нутрициолог": return NUTRITIONIST_KEYBOARD
+    if role == "фитнес-тренер": return FITNESS_TRAINER_KEYBOARD
+    if role == "психотерапевт": return PSYCHOTHERAPIST_KEYBOARD
+    if role == "ты из будущего": return FUTURE_SELF_KEYBOARD
+    return GENERAL_SPECIALIST_KEYBOARD
+
 async def handle_role_selection(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     requested_role_display = update.message.text
@@ -196,13 +299,10 @@ async def handle_role_selection(update: Update, context: ContextTypes.DEFAULT_TY
 
     data = get_user_data_from_db(user_id)
     data["current_role"] = requested_role
+    data.pop('context_state', None)
     save_user_data_to_db(user_id, data)
 
-    if requested_role == "нутрициолог": role_keyboard = NUTRITIONIST_KEYBOARD
-    elif requested_role == "фитнес-тренер": role_keyboard = FITNESS_TRAINER_KEYBOARD
-    elif requested_role == "психотерапевт": role_keyboard = PSYCHOTHERAPIST_KEYBOARD
-    elif requested_role == "ты из будущего": role_keyboard = FUTURE_SELF_KEYBOARD
-    else: role_keyboard = GENERAL_SPECIALIST_KEYBOARD
+    role_keyboard = get_role_keyboard(requested_role)
     
     await update.message.reply_text("Минутку, соединяю со специалистом...", reply_markup=ReplyKeyboardRemove())
 
@@ -328,6 +428,7 @@ async def finalize_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
     save_user_data_to_db(user_id, data)
+    schedule_user_reminders(user_id, data)
     context.user_data.clear()
 
 async def cancel_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -380,16 +481,6 @@ async def calculate_kbzhu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка расчета КБЖУ: {e}")
         await update.message.reply_text("Произошла ошибка при расчете. Проверь данные в своем профиле.", reply_markup=NUTRITIONIST_KEYBOARD)
 
-async def nutritionist_consultation_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "Я — AI-ассистент и могу дать общие рекомендации.\n\n"
-        "Для получения детальной и персональной консультации я настоятельно рекомендую обратиться к "
-        "сертифицированному врачу-диетологу или нутрициологу.\n\n"
-        "Вы можете найти специалистов на таких платформах, как Профи.ру, DocDoc или в "
-        "специализированных клиниках вашего города.",
-        reply_markup=NUTRITIONIST_KEYBOARD
-    )
-
 # --- Функционал Фитнес-тренера ---
 async def ask_workout_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Где ты предпочитаешь тренироваться?", reply_markup=ReplyKeyboardMarkup(WORKOUT_PLACE_KEYBOARD, one_time_keyboard=True, resize_keyboard=True))
@@ -489,15 +580,6 @@ async def explain_vo2max(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(explanation, reply_markup=FITNESS_TRAINER_KEYBOARD, parse_mode='HTML')
 
-async def trainer_consultation_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "Я — AI-тренер и могу составить хороший базовый план.\n\n"
-        "Для работы с травмами, подготовки к соревнованиям или если у тебя есть специфические цели, "
-        "я настоятельно рекомендую найти сертифицированного тренера для очных или онлайн-занятий.\n\n"
-        "Личный контроль и коррекция техники от профессионала — ключ к безопасному и быстрому прогрессу.",
-        reply_markup=FITNESS_TRAINER_KEYBOARD
-    )
-
 # --- Функционал Психотерапевта ---
 async def start_mood_logging(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text("Как ты себя чувствуешь прямо сейчас?", reply_markup=MOOD_SCALE_KEYBOARD)
@@ -526,6 +608,7 @@ async def finalize_mood_log(update: Update, context: ContextTypes.DEFAULT_TYPE)
     data.setdefault("mood_diary", []).append(entry)
     data["score"] = data.get("score", 0) + 5
     save_user_data_to_db(user_id, data)
+    schedule_user_reminders(user_id, data, kinds=("mood",))
 
     await update.message.reply_text(
         f"Спасибо, что поделился. Я записал твое настроение. Ты получаешь 5 баллов! ✨\n"
@@ -557,6 +640,118 @@ async def finalize_mood_log(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data.clear()
     return ConversationHandler.END
 
+# --- Диалог со специалистом ---
+@functools.lru_cache(maxsize=None)
+def get_chat_encoding():
+    return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str) -> int:
+    # 4 токена — служебная разметка каждого сообщения в chat completions.
+    return len(get_chat_encoding().encode(text)) + 4
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    encoding = get_chat_encoding()
+    tokens = encoding.encode(text)
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+def build_chat_messages(role: str, data: dict, history: dict, user_message: str) -> list:
+    system_prompt = (
+        f"{ROLES[role]} "
+        f"{get_personal_prompt(data.get('profile_data', {}), data.get('first_name'))}"
+        "Отвечай по существу, дружелюбно, используй эмодзи. "
+        "Если вопрос требует очной консультации, порекомендуй обратиться к живому специалисту. "
+        "ВАЖНО: Не используй markdown (звездочки, решетки)."
+    )
+    if history.get("summary"):
+        system_prompt += f"\nКраткое содержание предыдущего разговора: {history['summary']}"
+    # Если сводку не удалось обновить, старые реплики остаются в истории, но в промпт попадают только последние в пределах бюджета.
+    recent_turns = []
+    budget = CHAT_HISTORY_TOKEN_BUDGET
+    for who, text in reversed(history["turns"]):
+        budget -= count_tokens(text)
+        if budget < 0:
+            break
+        recent_turns.append({"role": "user" if who == "u" else "assistant", "content": text})
+    return [{"role": "system", "content": system_prompt}, *reversed(recent_turns), {"role": "user", "content": user_message}]
+
+async def compact_chat_history(history: dict):
+    """Сворачивает старые реплики в сводку, когда история превышает CHAT_HISTORY_TOKEN_BUDGET.
+
+    Сворачивается сразу до CHAT_HISTORY_KEEP_TOKENS, чтобы сводка обновлялась раз в несколько реплик, а не на каждой.
+    """
+    turns = history["turns"]
+    total = sum(count_tokens(text) for _, text in turns)
+    if total <= CHAT_HISTORY_TOKEN_BUDGET:
+        return
+    fold_count = 0
+    while fold_count < len(turns) and (total > CHAT_HISTORY_KEEP_TOKENS or turns[fold_count][0] == "a"):
+        total -= count_tokens(turns[fold_count][1])
+        fold_count += 1
+    folded = [f"{'Пользователь' if who == 'u' else 'Специалист'}: {text}" for who, text in turns[:fold_count]]
+
+    prompt = (
+        "Обнови краткое содержание разговора пользователя со специалистом. "
+        "Сохрани важные факты о пользователе, его вопросы, данные советы и договоренности. "
+        f"Не больше {CHAT_SUMMARY_MAX_TOKENS // 2} слов, без markdown.\n\n"
+        f"Текущее краткое содержание: {history.get('summary') or 'нет'}\n\n"
+        "Новые реплики:\n" + "\n".join(folded)
+    )
+    try:
+        response = await client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=CHAT_SUMMARY_MAX_TOKENS, temperature=0.3
+        )
+        history["summary"] = response.choices[0].message.content
+    except Exception as e:
+        # Реплики остаются в истории и попадут в сводку при следующей удачной попытке.
+        logger.error(f"Ошибка сжатия истории диалога: {e}")
+        return
+    del turns[:fold_count]
+
+async def start_specialist_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    data = get_user_data_from_db(user_id)
+    role = data.get("current_role")
+    if role not in ROLES:
+        await update.message.reply_text("Сначала выбери специалиста.", reply_markup=ROLE_KEYBOARD)
+        return
+    data['context_state'] = 'specialist_chat'
+    save_user_data_to_db(user_id, data)
+    await update.message.reply_text(
+        f"💬 Задай свой вопрос, {role} на связи. Я помню наш разговор, так что можно уточнять и продолжать.\n\n"
+        "Я — AI-ассистент и даю общие рекомендации. Для диагностики и лечения обращайся к живому специалисту.",
+        reply_markup=get_role_keyboard(role)
+    )
+
+async def handle_specialist_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, data: dict):
+    user_id = update.effective_user.id
+    role = data["current_role"]
+    history = data["chat_history"].setdefault(role, {"summary": "", "turns": []})
+    user_message = truncate_to_tokens(update.message.text, CHAT_MESSAGE_MAX_TOKENS)
+
+    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+    try:
+        response = await client.chat.completions.create(
+            model=CHAT_MODEL,
+            messages=build_chat_messages(role, data, history, user_message),
+            max_tokens=CHAT_REPLY_MAX_TOKENS, temperature=0.7
+        )
+        answer = response.choices[0].message.content
+        logger.info(f"Диалог {user_id}/{role}: {response.usage.prompt_tokens} входных токенов.")
+    except Exception as e:
+        logger.error(f"Ошибка ответа специалиста: {e}")
+        await update.message.reply_text("Не смог ответить. Что-то пошло не так с AI, попробуй еще раз.", reply_markup=get_role_keyboard(role))
+        return
+
+    await update.message.reply_text(answer, reply_markup=get_role_keyboard(role))
+    history["turns"] += [["u", user_message], ["a", answer]]
+    await compact_chat_history(history)
+    # Запись перечитывается после запросов к модели: напоминания и другие обработчики могли ее изменить.
+    data = get_user_data_from_db(user_id)
+    data["chat_history"][role] = history
+    save_user_data_to_db(user_id, data)
+
 # --- Функционал "Ты из будущего" ---
 async def start_future_self_image_generation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -570,6 +765,58 @@ async def start_future_self_image_generation(update: Update, context: ContextTyp
     data['context_state'] = 'awaiting_future_self_photo'
     save_user_data_to_db(user_id, data)
 
+def perceptual_hash(image_bytes: bytes) -> str:
+    """dHash: 64 бита сравнения соседних пикселей изображения, уменьшенного до 9x8 в оттенках серого."""
+    with Image.open(BytesIO(image_bytes)) as image:
+        pixels = image.convert("L").resize((9, 8), Image.LANCZOS).tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+def is_usable_face_description(description) -> bool:
+    text = (description or "").strip().lower().replace("’", "'")
+    return bool(text) and not text.startswith(FACE_DESCRIPTION_REFUSALS)
+
+def get_face_cache(data: dict) -> list:
+    today = datetime.date.today().strftime('%Y-%m-%d')
+    data["face_cache"] = [
+        entry for entry in data.get("face_cache", [])
+        if entry["expires"] > today and is_usable_face_description(entry["description"])
+    ]
+    return data["face_cache"]
+
+def find_cached_face(data: dict, file_unique_id: str = None, photo_hash: str = None):
+    for entry in get_face_cache(data):
+        if file_unique_id and file_unique_id in entry["file_ids"]:
+            return entry
+        if photo_hash and bin(int(photo_hash, 16) ^ int(entry["phash"], 16)).count("1") <= FACE_HASH_MAX_DISTANCE:
+            return entry
+    return None
+
+def cache_face_description(data: dict, file_unique_id: str, photo_hash: str, description: str):
+    entry = find_cached_face(data, photo_hash=photo_hash)
+    if entry:
+        if file_unique_id not in entry["file_ids"]:
+            entry["file_ids"].append(file_unique_id)
+        return
+    expires = datetime.date.today() + datetime.timedelta(days=FACE_CACHE_TTL_DAYS)
+    data["face_cache"].append({
+        "file_ids": [file_unique_id],
+        "phash": photo_hash,
+        "description": description,
+        "expires": expires.strftime('%Y-%m-%d'),
+    })
+    del data["face_cache"][:-FACE_CACHE_MAX_ENTRIES]
+
+async def forget_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    data = get_user_data_from_db(user_id)
+    data["face_cache"] = []
+    save_user_data_to_db(user_id, data)
+    await update.message.reply_text("🗑️ Готово, я забыл описание твоего фото. В следующий раз проанализирую снимок заново.", reply_markup=FUTURE_SELF_KEYBOARD)
+
 async def handle_future_self_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     data = get_user_data_from_db(user_id)
@@ -584,23 +831,40 @@ async def handle_future_self_photo(update: Update, context: ContextTypes.DEFAULT
     await update.message.reply_text("✨ Анализирую твой образ и заглядываю в будущее... Это может занять до минуты.", reply_markup=FUTURE_SELF_KEYBOARD)
 
     try:
-        file_obj = await context.bot.get_file(update.message.photo[-1].file_id)
-        photo_bytes = await file_obj.download_as_bytes()
-        base64_image = encode_image(photo_bytes)
-
-        vision_prompt = "Опиши ключевые черты лица человека на этом фото (форма лица, цвет глаз, цвет волос, прическа, наличие бороды/усов, особые приметы) для использования в DALL-E 3. Описание должно быть лаконичным и точным."
-        vision_response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "text", "content": vision_prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                ]
-            }],
-            max_tokens=200
-        )
-        face_description = vision_response.choices[0].message.content
+        photo = update.message.photo[-1]
+        # Повторно присланное фото узнаем по file_unique_id без скачивания, похожее — по перцептивному хэшу без vision-запроса.
+        cached_face = find_cached_face(data, file_unique_id=photo.file_unique_id)
+        photo_hash = cached_face["phash"] if cached_face else None
+        if not cached_face:
+            file_obj = await context.bot.get_file(photo.file_id)
+            photo_bytes = await file_obj.download_as_bytes()
+            photo_hash = perceptual_hash(photo_bytes)
+            cached_face = find_cached_face(data, photo_hash=photo_hash)
+
+        if cached_face:
+            face_description = cached_face["description"]
+        else:
+            base64_image = encode_image(photo_bytes)
+            vision_prompt = "Опиши ключевые черты лица человека на этом фото (форма лица, цвет глаз, цвет волос, прическа, наличие бороды/усов, особые приметы) для использования в DALL-E 3. Описание должно быть лаконичным и точным."
+            vision_response = await client.chat.completions.create(
+                model="gpt-4o",
+                messages=[{
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": vision_prompt},
+                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                    ]
+                }],
+                max_tokens=200
+            )
+            face_description = vision_response.choices[0].message.content
+            if not is_usable_face_description(face_description):
+                logger.warning(f"Vision-модель не описала лицо пользователя {user_id}: {face_description!r}")
+                data = get_user_data_from_db(user_id)
+                data['context_state'] = 'awaiting_future_self_photo'
+                save_user_data_to_db(user_id, data)
+                await update.message.reply_text("🤔 Не получилось рассмотреть лицо на этом фото. Пришли другое — при хорошем свете, где лицо видно крупно и анфас.", reply_markup=FUTURE_SELF_KEYBOARD)
+                return
 
         await update.message.reply_text("🧬 Создаю твою новую версию...")
 
@@ -634,6 +898,11 @@ async def handle_future_self_photo(update: Update, context: ContextTypes.DEFAULT
             reply_markup=FUTURE_SELF_KEYBOARD
         )
 
+        # Описание кэшируется только после успешной генерации; запись перечитывается, чтобы не затереть изменения за время запросов.
+        data = get_user_data_from_db(user_id)
+        cache_face_description(data, photo.file_unique_id, photo_hash, face_description)
+        save_user_data_to_db(user_id, data)
+
     except Exception as e:
         logger.error(f"Ошибка генерации образа будущего: {e}")
         await update.message.reply_text("🔮 Что-то пошло не так, и линия будущего оказалась размытой. Попробуй еще раз чуть позже.", reply_markup=FUTURE_SELF_KEYBOARD)
@@ -658,9 +927,391 @@ async def log_workout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     entry = f"{today_str} - Тренировка ({workout_type}) выполнена! 💪 +15 очков."
     data.setdefault("workout_diary", []).append(entry)
     save_user_data_to_db(user_id, data)
+    schedule_user_reminders(user_id, data, kinds=("streak",))
     
     await update.message.reply_text(f"Поздравляю! 🏆 Твой успех записан в дневник, и ты получаешь 15 баллов. Твой текущий счет: {data['score']}.", reply_markup=DIARIES_KEYBOARD)
-    await check_profile_update(update, context)
+    await check_profile_update(update, context, data)
+
+# --- Напоминания ---
+class ReminderQueue:
+    """Мин-куча напоминаний, упорядоченная по времени срабатывания (UTC timestamp).
+
+    Для каждой пары (user_id, kind) действительна только последняя запись в `_due`,
+    устаревшие элементы кучи отбрасываются лениво при извлечении.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+
+    def __len__(self):
+        return len(self._due)
+
+    def schedule(self, user_id, kind, due_ts):
+        key = (str(user_id), kind)
+        self._due[key] = due_ts
+        heapq.heappush(self._heap, (due_ts, key))
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(ts, k) for k, ts in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def cancel(self, user_id, kind):
+        self._due.pop((str(user_id), kind), None)
+
+    def pop_due(self, now_ts, limit):
+        due = []
+        while self._heap and len(due) < limit and self._heap[0][0] <= now_ts:
+            due_ts, key = heapq.heappop(self._heap)
+            if self._due.get(key) != due_ts:
+                continue
+            del self._due[key]
+            due.append(key)
+        return due
+
+reminder_queue = ReminderQueue()
+
+def get_user_timezone(data: dict):
+    try:
+        return ZoneInfo(data["reminders"].get("timezone") or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+def is_quiet_hour(hour: int, quiet_hours) -> bool:
+    start, end = quiet_hours
+    if start == end:
+        return False
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+def local_due_timestamp(data: dict, day: datetime.date, hour: int) -> float:
+    """UTC timestamp момента hour:00 по местному времени пользователя; тихие часы сдвигают его на их окончание."""
+    quiet_hours = data["reminders"].get("quiet_hours") or DEFAULT_QUIET_HOURS
+    if is_quiet_hour(hour, quiet_hours):
+        end = quiet_hours[1]
+        if hour >= end:
+            day += datetime.timedelta(days=1)
+        hour = end
+    due = datetime.datetime.combine(day, datetime.time(hour), tzinfo=get_user_timezone(data))
+    return due.timestamp()
+
+def parse_diary_date(entry_date: str):
+    try:
+        return datetime.datetime.strptime(entry_date[:10], '%d.%m.%Y').date()
+    except (ValueError, TypeError):
+        return None
+
+def get_workout_streak(data: dict) -> int:
+    days = sorted({d for d in (parse_diary_date(e) for e in data.get("workout_diary", [])) if d}, reverse=True)
+    streak = 0
+    for i, day in enumerate(days):
+        if day != days[0] - datetime.timedelta(days=i):
+            break
+        streak += 1
+    return streak
+
+def next_reminder_due(kind: str, data: dict, now_ts: float):
+    """Время следующего напоминания вида kind или None, если напоминать не нужно."""
+    reminders = data["reminders"]
+    if not reminders.get("enabled", True):
+        return None
+    now_local = datetime.datetime.fromtimestamp(now_ts, get_user_timezone(data))
+    today = now_local.date()
+    last_sent_str = reminders["last_sent"].get(kind)
+    last_sent = datetime.date.fromisoformat(last_sent_str) if last_sent_str else None
+
+    if kind == "profile":
+        last_updated_str = data.get("profile_data", {}).get("last_updated")
+        if not last_updated_str:
+            return None
+        last_updated = datetime.datetime.strptime(last_updated_str, '%Y-%m-%d').date()
+        day = last_updated + datetime.timedelta(days=PROFILE_STALE_DAYS + 1)
+        if last_sent:
+            day = max(day, last_sent + datetime.timedelta(days=PROFILE_REMINDER_REPEAT_DAYS))
+        hour = PROFILE_REMINDER_HOUR
+    elif kind == "mood":
+        mood_diary = data.get("mood_diary", [])
+        logged_today = bool(mood_diary) and parse_diary_date(mood_diary[-1].get("date")) == today
+        day = today + datetime.timedelta(days=1) if logged_today or last_sent == today else today
+        hour = MOOD_REMINDER_HOUR
+    elif kind == "streak":
+        last_workouts = [d for d in (parse_diary_date(e) for e in data.get("workout_diary", [])[-1:]) if d]
+        if not last_workouts:
+            return None
+        day = last_workouts[0] + datetime.timedelta(days=1)
+        if day < today or (last_sent and last_sent >= day):
+            return None
+        hour = STREAK_REMINDER_HOUR
+    else:
+        return None
+
+    if day > today:
+        return local_due_timestamp(data, day, hour)
+    due_ts = local_due_timestamp(data, today, hour)
+    if due_ts > now_ts:
+        return due_ts
+    if not is_quiet_hour(now_local.hour, reminders.get("quiet_hours") or DEFAULT_QUIET_HOURS):
+        return now_ts
+    # В тихие часы просроченное напоминание о профиле ждет утра, а дневные теряют смысл.
+    if kind == "profile":
+        return local_due_timestamp(data, today, now_local.hour)
+    if kind == "mood":
+        return local_due_timestamp(data, today + datetime.timedelta(days=1), hour)
+    return None
+
+def schedule_user_reminders(user_id, data: dict, kinds=REMINDER_KINDS, now_ts: float = None):
+    now_ts = time.time() if now_ts is None else now_ts
+    for kind in kinds:
+        due_ts = next_reminder_due(kind, data, now_ts)
+        if due_ts is None:
+            reminder_queue.cancel(user_id, kind)
+        else:
+            reminder_queue.schedule(user_id, kind, due_ts)
+
+def build_reminder_text(kind: str, data: dict) -> str:
+    if kind == "profile":
+        return PROFILE_UPDATE_REMINDER_TEXT
+    if kind == "mood":
+        return ("🧠 Как прошел твой день? Отметь настроение в дневнике — это займет всего минуту "
+                "и принесет тебе 5 баллов. Дневник настроения есть в меню Психотерапевта.")
+    if kind == "streak":
+        return (f"🔥 Твоя серия тренировок: {get_workout_streak(data)} дн. подряд! "
+                "Не прерывай ее — отметь сегодняшнюю тренировку в Дневнике тренировок.")
+    return ""
+
+def mark_reminder_sent(user_id, kind: str, sent: bool, now_ts: float) -> dict:
+    # Чтение и запись без await между ними: правки, сохраненные обработчиками во время отправки, не затираются.
+    data = get_user_data_from_db(user_id)
+    if sent:
+        today = datetime.datetime.fromtimestamp(now_ts, get_user_timezone(data)).date()
+        data["reminders"]["last_sent"][kind] = today.isoformat()
+    else:
+        data["reminders"]["enabled"] = False
+    save_user_data_to_db(user_id, data)
+    return data
+
+async def send_due_reminder(bot, user_id: str, kind: str, now_ts: float):
+    data = await asyncio.to_thread(get_user_data_from_db, user_id)
+    due_ts = next_reminder_due(kind, data, now_ts)
+    if due_ts is None:
+        return
+    if due_ts > now_ts:
+        reminder_queue.schedule(user_id, kind, due_ts)
+        return
+    await send_limiter.acquire()
+    try:
+        await bot.send_message(chat_id=int(user_id), text=build_reminder_text(kind, data), reply_markup=MAIN_MENU_KEYBOARD)
+        sent = True
+    except RetryAfter as e:
+        send_limiter.pause(get_retry_after_seconds(e))
+        reminder_queue.schedule(user_id, kind, time.time() + get_retry_after_seconds(e))
+        return
+    except (Forbidden, BadRequest) as e:
+        logger.info(f"Напоминания для пользователя {user_id} выключены: {e}")
+        sent = False
+    data = await asyncio.to_thread(mark_reminder_sent, user_id, kind, sent, now_ts)
+    schedule_user_reminders(user_id, data, kinds=(kind,), now_ts=now_ts)
+
+async def process_due_reminders(context: ContextTypes.DEFAULT_TYPE):
+    now_ts = time.time()
+    for user_id, kind in reminder_queue.pop_due(now_ts, REMINDER_BATCH_SIZE):
+        try:
+            await send_due_reminder(context.bot, user_id, kind, now_ts)
+        except Exception as e:
+            logger.error(f"Ошибка обработки напоминания {kind} пользователя {user_id}: {e}")
+            reminder_queue.schedule(user_id, kind, time.time() + REMINDER_RETRY_SECONDS)
+
+async def index_reminders(context: ContextTypes.DEFAULT_TYPE):
+    """Первичное заполнение очереди после запуска: по REMINDER_BATCH_SIZE пользователей за тик.
+
+    context.job.data — генератор iter_users_data; пачка читается из базы в отдельном потоке, не блокируя обработку обновлений.
+    """
+    users = context.job.data
+    batch = await asyncio.to_thread(list, itertools.islice(users, REMINDER_BATCH_SIZE))
+    for user_id, data in batch:
+        try:
+            schedule_user_reminders(user_id, fill_user_data_defaults(data))
+        except Exception as e:
+            logger.error(f"Не удалось запланировать напоминания пользователя {user_id}: {e}")
+    if len(batch) < REMINDER_BATCH_SIZE:
+        logger.info(f"Очередь напоминаний заполнена: {len(reminder_queue)} записей.")
+        context.job.schedule_removal()
+
+async def reminders_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    data = get_user_data_from_db(user_id)
+    reminders = data["reminders"]
+    if context.args and context.args[0].lower() in ("on", "off"):
+        reminders["enabled"] = context.args[0].lower() == "on"
+        save_user_data_to_db(user_id, data)
+        schedule_user_reminders(user_id, data)
+    start, end = reminders["quiet_hours"]
+    await update.message.reply_text(
+        f"🔔 Напоминания: {'включены' if reminders['enabled'] else 'выключены'}\n"
+        f"🌍 Часовой пояс: {reminders['timezone']}\n"
+        f"🌙 Тихие часы: с {start}:00 до {end}:00\n\n"
+        "/reminders on или /reminders off — включить или выключить напоминания\n"
+        "/timezone Europe/Moscow — сменить часовой пояс\n"
+        "/quiet 22 8 — задать тихие часы",
+        reply_markup=MAIN_MENU_KEYBOARD
+    )
+
+async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args:
+        await update.message.reply_text("Укажи часовой пояс, например: /timezone Europe/Moscow")
+        return
+    try:
+        ZoneInfo(context.args[0])
+    except (ZoneInfoNotFoundError, ValueError):
+        await update.message.reply_text("Не знаю такой часовой пояс. Пример: /timezone Asia/Yekaterinburg")
+        return
+    user_id = update.effective_user.id
+    data = get_user_data_from_db(user_id)
+    data["reminders"]["timezone"] = context.args[0]
+    save_user_data_to_db(user_id, data)
+    schedule_user_reminders(user_id, data)
+    await update.message.reply_text(f"🌍 Часовой пояс обновлен: {context.args[0]}", reply_markup=MAIN_MENU_KEYBOARD)
+
+async def set_quiet_hours(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        start, end = (int(arg) for arg in context.args)
+        if not (0 <= start < 24 and 0 <= end < 24): raise ValueError
+    except (ValueError, TypeError):
+        await update.message.reply_text("Укажи начало и конец тихих часов, например: /quiet 22 8")
+        return
+    user_id = update.effective_user.id
+    data = get_user_data_from_db(user_id)
+    data["reminders"]["quiet_hours"] = [start, end]
+    save_user_data_to_db(user_id, data)
+    schedule_user_reminders(user_id, data)
+    await update.message.reply_text(f"🌙 Тихие часы: с {start}:00 до {end}:00. В это время я не буду беспокоить.", reply_markup=MAIN_MENU_KEYBOARD)
+
+# --- Рассылка ---
+def get_broadcast_state():
+    if BROADCAST_STATE_KEY not in db:
+        return None
+    try:
+        return json.loads(db[BROADCAST_STATE_KEY])
+    except json.JSONDecodeError:
+        return None
+
+def save_broadcast_state(state: dict):
+    db[BROADCAST_STATE_KEY] = json.dumps(state)
+
+def format_broadcast_report(state: dict) -> str:
+    elapsed = max(state.get("elapsed", 0), 1e-6)
+    status_labels = {"running": "идет", "done": "завершена", "stopped": "остановлена"}
+    return (
+        f"📣 Рассылка {status_labels.get(state['status'], state['status'])}\n"
+        f"✅ Доставлено: {state['sent']}\n"
+        f"🚫 Заблокировали бота: {state['blocked']}\n"
+        f"⚠️ Ошибок: {state['failed']}\n"
+        f"⚡ Скорость: {state['sent'] / elapsed:.1f} сообщ./с"
+    )
+
+async def send_broadcast_message(bot, user_id: str, text: str) -> str:
+    for _ in range(BROADCAST_MAX_RETRIES):
+        # Рассылка уступает ответам пользователям и напоминаниям: токен берется только из запаса сверх BROADCAST_RESERVE_TOKENS.
+        await send_limiter.acquire(reserve=BROADCAST_RESERVE_TOKENS)
+        try:
+            await bot.send_message(chat_id=int(user_id), text=text)
+            return "sent"
+        except RetryAfter as e:
+            delay = get_retry_after_seconds(e)
+            logger.warning(f"Рассылка: превышен лимит Telegram, пауза {delay} с.")
+            send_limiter.pause(delay)
+        except Forbidden:
+            return "blocked"
+        except Exception as e:
+            logger.error(f"Рассылка: ошибка отправки пользователю {user_id}: {e}")
+            return "failed"
+    return "failed"
+
+async def run_broadcast(bot, state: dict):
+    """Рассылает state["text"] всем пользователям после state["cursor"], сохраняя прогресс после каждой пачки.
+
+    При перезапуске рассылка продолжается с последней сохраненной пачки, так что повторно
+    сообщение могут получить не больше BROADCAST_CHUNK_SIZE пользователей.
+    """
+    user_ids = iter_user_ids(db, after=state.get("cursor"))
+    resumed_elapsed = state.get("elapsed", 0)
+    started = time.monotonic()
+    while True:
+        chunk = list(itertools.islice(user_ids, BROADCAST_CHUNK_SIZE))
+        if not chunk:
+            break
+        results = await asyncio.gather(*(send_broadcast_message(bot, uid, state["text"]) for uid in chunk))
+        for result in results:
+            state[result] += 1
+        state["cursor"] = chunk[-1]
+        state["elapsed"] = resumed_elapsed + time.monotonic() - started
+        # Пока шла пачка, /broadcast_stop мог изменить статус в базе — его нельзя затереть.
+        current = get_broadcast_state()
+        if not current or current.get("id") != state["id"]:
+            logger.info(f"Рассылка {state['id']} заменена другой.")
+            return
+        state["status"] = current["status"]
+        save_broadcast_state(state)
+        if state["status"] != "running":
+            logger.info(f"Рассылка {state['id']} остановлена.")
+            return
+    state["status"] = "done"
+    save_broadcast_state(state)
+    logger.info(f"Рассылка {state['id']} завершена: {state['sent']} доставлено, {state['blocked'] + state['failed']} не доставлено.")
+    try:
+        await bot.send_message(chat_id=state["admin_id"], text=format_broadcast_report(state))
+    except Exception as e:
+        logger.error(f"Не удалось отправить отчет о рассылке: {e}")
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    text = update.message.text.partition(" ")[2].strip()
+    if not text:
+        await update.message.reply_text("Напиши текст рассылки после команды: /broadcast Текст сообщения")
+        return
+    state = get_broadcast_state()
+    if state and state.get("status") == "running":
+        await update.message.reply_text("Уже идет другая рассылка. /broadcast_status — прогресс, /broadcast_stop — остановить.")
+        return
+    state = {
+        "id": datetime.datetime.now().strftime('%Y%m%d%H%M%S'),
+        "text": text,
+        "admin_id": update.effective_user.id,
+        "status": "running",
+        "cursor": None,
+        "sent": 0, "blocked": 0, "failed": 0,
+        "elapsed": 0,
+    }
+    save_broadcast_state(state)
+    context.application.create_task(run_broadcast(context.bot, state))
+    await update.message.reply_text("📣 Рассылка запущена. Прогресс: /broadcast_status")
+
+async def broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    state = get_broadcast_state()
+    if not state:
+        await update.message.reply_text("Рассылок еще не было.")
+        return
+    await update.message.reply_text(format_broadcast_report(state))
+
+async def broadcast_stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    state = get_broadcast_state()
+    if not state or state.get("status") != "running":
+        await update.message.reply_text("Сейчас нет активной рассылки.")
+        return
+    state["status"] = "stopped"
+    save_broadcast_state(state)
+    await update.message.reply_text("Рассылка будет остановлена после текущей пачки сообщений.")
+
+async def resume_broadcast(context: ContextTypes.DEFAULT_TYPE):
+    state = get_broadcast_state()
+    if state and state.get("status") == "running":
+        logger.info(f"Продолжаю прерванную рассылку {state['id']} с пользователя после {state.get('cursor')}.")
+        await run_broadcast(context.bot, state)
 
 # --- Главный обработчик сообщений ---
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -675,12 +1326,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         "⬅️ назад в главное меню": start,
         "⬅️ назад к выбору специалиста": choose_specialist,
         "рассчитать кбжу 📊": calculate_kbzhu,
-        "задать вопрос нутрициологу ❓": nutritionist_consultation_info,
+        "задать вопрос нутрициологу ❓": start_specialist_chat,
         "рассчитать имт 📉": calculate_bmi,
         "что такое vo2max ❓": explain_vo2max,
-        "задать вопрос тренеру ❓": trainer_consultation_info,
+        "задать вопрос тренеру ❓": start_specialist_chat,
+        "задать вопрос психотерапевту ❓": start_specialist_chat,
+        "задать вопрос специалисту ❓": start_specialist_chat,
         "дневник тренировок 🏋️": start_workout_logging,
         "создать мое спортивное будущее 🔮": start_future_self_image_generation,
+        "забыть мое фото 🗑️": forget_photo,
     }
 
     if message_text.capitalize() in ROLE_BUTTON_LABELS:
@@ -699,6 +1353,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await handler_func(update, context)
         return
 
+    data = get_user_data_from_db(update.effective_user.id)
+    if data.get('context_state') == 'specialist_chat' and data.get("current_role") in ROLES:
+        await handle_specialist_chat(update, context, data)
+        return
+
     await update.message.reply_text("Извините, я не понял команду. Пожалуйста, используйте кнопки.", reply_markup=MAIN_MENU_KEYBOARD)
 
 
@@ -738,8 +1397,16 @@ def main() -> None:
         fallbacks=[CommandHandler('cancel', cancel_dialog)],
     )
 
+    application.add_handler(TypeHandler(Update, count_interactive_update), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("leaderboard", leaderboard))
+    application.add_handler(CommandHandler("reminders", reminders_settings))
+    application.add_handler(CommandHandler("timezone", set_timezone))
+    application.add_handler(CommandHandler("quiet", set_quiet_hours))
+    application.add_handler(CommandHandler("forget_photo", forget_photo))
+    application.add_handler(CommandHandler("broadcast", broadcast))
+    application.add_handler(CommandHandler("broadcast_status", broadcast_status))
+    application.add_handler(CommandHandler("broadcast_stop", broadcast_stop))
     
     application.add_handler(profile_handler)
     application.add_handler(workout_plan_handler)
@@ -751,6 +1418,10 @@ def main() -> None:
 
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+    application.job_queue.run_repeating(index_reminders, interval=REMINDER_TICK_SECONDS, first=1, data=iter_users_data(db))
+    application.job_queue.run_repeating(process_due_reminders, interval=REMINDER_TICK_SECONDS, first=REMINDER_TICK_SECONDS)
+    application.job_queue.run_once(resume_broadcast, when=1)
+
     logger.info("Бот запущен и работает...")
     application.run_polling()
 
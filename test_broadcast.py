@@ -0,0 +1,146 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+from telegram.error import Forbidden, RetryAfter
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import main
+
+ADMIN_ID = 999
+
+
+class PrefixStore(dict):
+    def prefix(self, prefix):
+        return tuple(key for key in self if key.startswith(prefix))
+
+
+class StubBot:
+    def __init__(self, on_send=None):
+        self.recipients = []
+        self.reports = []
+        self.on_send = on_send
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == ADMIN_ID:
+            self.reports.append(text)
+            return
+        if self.on_send:
+            self.on_send(self, chat_id)
+        self.recipients.append(chat_id)
+
+
+@pytest.fixture
+def users(monkeypatch):
+    store = PrefixStore({str(uid): json.dumps({"first_name": f"user{uid}"}) for uid in range(1, 350)})
+    monkeypatch.setattr(main, "db", store)
+    monkeypatch.setattr(main, "send_limiter", main.TokenBucket(100000))
+    return sorted(store)
+
+
+def start_broadcast(cursor=None):
+    state = {
+        "id": "20261019120000", "text": "Новости HealCo", "admin_id": ADMIN_ID, "status": "running",
+        "cursor": cursor, "sent": 0, "blocked": 0, "failed": 0, "elapsed": 0,
+    }
+    main.save_broadcast_state(state)
+    return state
+
+
+def test_overlapping_pauses_take_longest_delay():
+    bucket = main.TokenBucket(10)
+    for _ in range(10):
+        bucket.pause(5)
+    assert bucket._tokens == pytest.approx(-50, abs=0.1)
+
+    bucket.pause(2)
+    assert bucket._tokens == pytest.approx(-50, abs=0.1)
+    bucket.pause(8)
+    assert bucket._tokens == pytest.approx(-80, abs=0.1)
+
+
+def test_concurrent_retry_after_stalls_once():
+    bucket = main.TokenBucket(100)
+
+    async def hit_flood_limit():
+        bucket.pause(0.05)
+        await bucket.acquire()
+
+    async def scenario():
+        await asyncio.wait_for(asyncio.gather(*(hit_flood_limit() for _ in range(10))), timeout=2)
+
+    started = time.monotonic()
+    asyncio.run(scenario())
+    assert time.monotonic() - started < 0.4
+
+
+def test_reserve_leaves_tokens_for_priority_senders():
+    bucket = main.TokenBucket(1, capacity=5)
+    bucket.consume(3)
+
+    async def scenario():
+        await asyncio.wait_for(bucket.acquire(), timeout=0.05)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(bucket.acquire(reserve=2), timeout=0.05)
+
+    asyncio.run(scenario())
+    bucket.consume(100)
+    assert bucket._tokens >= -bucket.capacity
+
+
+def test_broadcast_counts_results_and_reports(users):
+    blocked, failed, flooded = 7, 8, 9
+
+    async def send_message(chat_id, text, **kwargs):
+        if chat_id == ADMIN_ID:
+            bot.reports.append(text)
+        elif chat_id == blocked:
+            raise Forbidden("bot was blocked by the user")
+        elif chat_id == failed:
+            raise RuntimeError("network down")
+        elif chat_id == flooded and flooded not in bot.recipients:
+            bot.recipients.append(chat_id)
+            raise RetryAfter(0)
+        else:
+            bot.recipients.append(chat_id)
+
+    bot = StubBot()
+    bot.send_message = send_message
+    state = start_broadcast()
+    asyncio.run(main.run_broadcast(bot, state))
+
+    stored = main.get_broadcast_state()
+    assert stored["status"] == "done"
+    assert (stored["sent"], stored["blocked"], stored["failed"]) == (len(users) - 2, 1, 1)
+    assert stored["cursor"] == users[-1]
+    assert len(bot.reports) == 1
+
+
+def test_stop_during_chunk_is_kept(users):
+    def stop_on_fifth_message(bot, chat_id):
+        if len(bot.recipients) == 4:
+            state = main.get_broadcast_state()
+            state["status"] = "stopped"
+            main.save_broadcast_state(state)
+
+    bot = StubBot(on_send=stop_on_fifth_message)
+    asyncio.run(main.run_broadcast(bot, start_broadcast()))
+
+    stored = main.get_broadcast_state()
+    assert stored["status"] == "stopped"
+    assert len(bot.recipients) == stored["sent"] == main.BROADCAST_CHUNK_SIZE
+    assert stored["cursor"] == users[main.BROADCAST_CHUNK_SIZE - 1]
+    assert bot.reports == []
+
+
+def test_broadcast_resumes_after_cursor(users):
+    cursor = users[200]
+    bot = StubBot()
+    asyncio.run(main.run_broadcast(bot, start_broadcast(cursor=cursor)))
+
+    assert sorted(str(uid) for uid in bot.recipients) == users[201:]
+    assert main.get_broadcast_state()["sent"] == len(users) - 201
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import db_tool
+
+
+class PrefixStore(dict):
+    def prefix(self, prefix):
+        return tuple(key for key in self if key.startswith(prefix))
+
+
+@pytest.fixture
+def source():
+    store = PrefixStore({str(uid): json.dumps({"first_name": f"user{uid}", "score": uid}) for uid in range(1, 1001)})
+    store["broadcast_state"] = json.dumps({"status": "done"})
+    return store
+
+
+def test_export_import_round_trip(source, tmp_path):
+    path = str(tmp_path / "users.ndjson.gz")
+    manifest = db_tool.export_users(source, path)
+    assert manifest["count"] == 1000
+
+    target = {}
+    assert db_tool.import_users(target, path) == 1000
+    assert "broadcast_state" not in target
+    assert db_tool.verify_import(target, path) == 0
+
+
+def test_import_resumes_from_progress(source, tmp_path):
+    path = str(tmp_path / "users.ndjson")
+    db_tool.export_users(source, path)
+    with open(path + ".progress", "w", encoding="utf-8") as f:
+        f.write("300")
+
+    target = {}
+    db_tool.import_users(target, path)
+    assert len(target) == 700
+    assert db_tool.verify_import(target, path) == 300
+
+
+def test_import_rejects_file_that_does_not_match_manifest(source, tmp_path):
+    path = str(tmp_path / "users.ndjson")
+    db_tool.export_users(source, path)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"id": "999999", "data": {}}) + "\n")
+
+    with pytest.raises(ValueError):
+        db_tool.import_users({}, path)
+
+
+def test_user_ids_after_cursor_without_prefix_support():
+    store = {"12": "{}", "3": "{}", "25": "{}", "broadcast_state": "{}"}
+    assert list(db_tool.iter_user_ids(store)) == ["12", "25", "3"]
+    assert list(db_tool.iter_user_ids(store, after="12")) == ["25", "3"]
+
+
+def test_invalid_records_round_trip_as_raw(source, tmp_path):
+    path = str(tmp_path / "users.ndjson")
+    source["1001"] = "{не JSON"
+    manifest = db_tool.export_users(source, path)
+    assert (manifest["count"], manifest["invalid"]) == (1001, 1)
+
+    target = {}
+    db_tool.import_users(target, path)
+    assert target["1001"] == "{не JSON"
+    assert db_tool.verify_import(target, path) == 0
+
+    target["1001"] = "{}"
+    assert db_tool.verify_import(target, path) == 1
+
+
+class CountingStore(dict):
+    keys_calls = 0
+
+    def keys(self):
+        self.keys_calls += 1
+        return super().keys()
+
+
+def test_bulk_read_streams_keys_without_sorting():
+    store = PrefixStore({"12": "{}", "10": "{}", "3": "{}"})
+    assert [user_id for user_id, _ in db_tool.iter_raw_users(store)] == ["12", "10", "3"]
+
+    counting = CountingStore({"3": "{}", "12": "{}", "broadcast_state": "{}"})
+    assert sorted(user_id for user_id, _ in db_tool.iter_users_data(counting)) == ["12", "3"]
+    assert list(db_tool.iter_user_ids(counting, after="12")) == ["3"]
+    assert counting.keys_calls == 2
@@ -0,0 +1,129 @@
+import asyncio
+import base64
+import os
+from io import BytesIO
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from PIL import Image
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import main
+
+USER_ID = 1
+
+
+def make_photo_bytes(size=(400, 400), quality=90):
+    buffer = BytesIO()
+    Image.radial_gradient("L").resize(size).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class StubVisionClient:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.describe))
+        self.images = SimpleNamespace(generate=self.generate)
+        self.vision_calls = 0
+        self.description = "Овальное лицо, карие глаза"
+        self.fail_generation = False
+
+    async def describe(self, model, messages, max_tokens):
+        self.vision_calls += 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.description))])
+
+    async def generate(self, **kwargs):
+        if self.fail_generation:
+            raise RuntimeError("content policy violation")
+        return SimpleNamespace(data=[SimpleNamespace(b64_json=base64.b64encode(b"image").decode())])
+
+
+@pytest.fixture
+def vision_client(monkeypatch):
+    client = StubVisionClient()
+    monkeypatch.setattr(main, "db", {})
+    monkeypatch.setattr(main, "client", client)
+    return client
+
+
+def send_photo(file_unique_id, photo_bytes, image_sent=True):
+    data = main.get_user_data_from_db(USER_ID)
+    data["context_state"] = "awaiting_future_self_photo"
+    main.save_user_data_to_db(USER_ID, data)
+
+    file_obj = SimpleNamespace(download_as_bytes=AsyncMock(return_value=photo_bytes))
+    bot = SimpleNamespace(get_file=AsyncMock(return_value=file_obj), send_photo=AsyncMock())
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=USER_ID),
+        effective_chat=SimpleNamespace(id=USER_ID),
+        message=SimpleNamespace(
+            photo=[SimpleNamespace(file_id=f"file-{file_unique_id}", file_unique_id=file_unique_id)],
+            reply_text=AsyncMock(),
+        ),
+    )
+    asyncio.run(main.handle_future_self_photo(update, SimpleNamespace(bot=bot)))
+    assert bot.send_photo.await_count == int(image_sent)
+    return bot
+
+
+def test_repeat_photo_reuses_face_description(vision_client):
+    send_photo("a", make_photo_bytes())
+    assert vision_client.vision_calls == 1
+    assert main.get_user_data_from_db(USER_ID)["face_cache"][0]["file_ids"] == ["a"]
+
+    bot = send_photo("a", make_photo_bytes())
+    bot.get_file.assert_not_awaited()
+    assert vision_client.vision_calls == 1
+
+    bot = send_photo("b", make_photo_bytes(size=(300, 300), quality=40))
+    bot.get_file.assert_awaited_once()
+    assert vision_client.vision_calls == 1
+    assert main.get_user_data_from_db(USER_ID)["face_cache"][0]["file_ids"] == ["a", "b"]
+
+
+def test_expired_and_forgotten_photos_are_described_again(vision_client):
+    send_photo("a", make_photo_bytes())
+    data = main.get_user_data_from_db(USER_ID)
+    data["face_cache"][0]["expires"] = "2000-01-01"
+    main.save_user_data_to_db(USER_ID, data)
+
+    send_photo("a", make_photo_bytes())
+    assert vision_client.vision_calls == 2
+
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=USER_ID), message=SimpleNamespace(reply_text=AsyncMock()))
+    asyncio.run(main.forget_photo(update, SimpleNamespace()))
+    assert main.get_user_data_from_db(USER_ID)["face_cache"] == []
+
+    send_photo("a", make_photo_bytes())
+    assert vision_client.vision_calls == 3
+
+
+@pytest.mark.parametrize("description", [None, "", "I'm sorry, I can't help with identifying people in images."])
+def test_unusable_description_is_not_cached(vision_client, description):
+    vision_client.description = description
+    vision_client.images.generate = AsyncMock()
+    send_photo("a", make_photo_bytes(), image_sent=False)
+
+    vision_client.images.generate.assert_not_awaited()
+    data = main.get_user_data_from_db(USER_ID)
+    assert data["face_cache"] == []
+    assert data["context_state"] == "awaiting_future_self_photo"
+
+    vision_client.description = "Овальное лицо, карие глаза"
+    vision_client.images.generate = StubVisionClient().generate
+    send_photo("a", make_photo_bytes())
+    assert vision_client.vision_calls == 2
+    assert main.get_user_data_from_db(USER_ID)["face_cache"][0]["description"] == "Овальное лицо, карие глаза"
+
+
+def test_description_is_cached_only_after_image_is_generated(vision_client):
+    vision_client.fail_generation = True
+    send_photo("a", make_photo_bytes(), image_sent=False)
+    assert main.get_user_data_from_db(USER_ID)["face_cache"] == []
+
+    vision_client.fail_generation = False
+    send_photo("a", make_photo_bytes())
+    assert vision_client.vision_calls == 2
+    assert len(main.get_user_data_from_db(USER_ID)["face_cache"]) == 1
@@ -0,0 +1,216 @@
+import asyncio
+import datetime
+import json
+import os
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock
+from zoneinfo import ZoneInfo
+
+import pytest
+from telegram.error import Forbidden, RetryAfter
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import main
+from db_tool import iter_users_data
+
+MOSCOW = ZoneInfo("Europe/Moscow")
+
+
+class PrefixStore(dict):
+    def prefix(self, prefix):
+        return tuple(key for key in self if key.startswith(prefix))
+
+
+def make_user(**overrides):
+    data = main.fill_user_data_defaults({})
+    data["reminders"].update(overrides.pop("reminders", {}))
+    data.update(overrides)
+    return data
+
+
+def at(year, month, day, hour, minute=0, tz=MOSCOW):
+    return datetime.datetime(year, month, day, hour, minute, tzinfo=tz)
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    queue = main.ReminderQueue()
+    monkeypatch.setattr(main, "reminder_queue", queue)
+    monkeypatch.setattr(main, "db", PrefixStore())
+    monkeypatch.setattr(main, "send_limiter", main.TokenBucket(1000))
+    return queue
+
+
+def test_queue_pops_only_latest_schedule_in_due_order():
+    queue = main.ReminderQueue()
+    queue.schedule(1, "mood", 5)
+    queue.schedule(1, "mood", 30)
+    queue.schedule(2, "mood", 10)
+    queue.schedule(3, "profile", 1)
+    queue.cancel(3, "profile")
+
+    assert queue.pop_due(20, limit=10) == [("2", "mood")]
+    assert queue.pop_due(40, limit=10) == [("1", "mood")]
+    assert len(queue) == 0
+
+
+def test_queue_respects_limit_and_rebuilds_heap():
+    queue = main.ReminderQueue()
+    for due_ts in range(5000):
+        queue.schedule(1, "mood", due_ts)
+    for user_id in range(10):
+        queue.schedule(100 + user_id, "mood", 1)
+
+    assert len(queue._heap) <= 2 * len(queue) + 1024
+    assert len(queue.pop_due(10, limit=3)) == 3
+    assert len(queue.pop_due(10, limit=100)) == 7
+
+
+def test_mood_reminder_uses_user_timezone():
+    now_ts = at(2026, 10, 19, 10, tz=datetime.timezone.utc).timestamp()
+    moscow = make_user()
+    yekaterinburg = make_user(reminders={"timezone": "Asia/Yekaterinburg"})
+
+    assert main.next_reminder_due("mood", moscow, now_ts) == at(2026, 10, 19, 20).timestamp()
+    assert main.next_reminder_due("mood", yekaterinburg, now_ts) == at(2026, 10, 19, 20, tz=ZoneInfo("Asia/Yekaterinburg")).timestamp()
+
+
+def test_mood_reminder_skips_day_already_logged():
+    data = make_user(mood_diary=[{"date": "19.10.2026", "mood_level": 4}])
+    assert main.next_reminder_due("mood", data, at(2026, 10, 19, 12).timestamp()) == at(2026, 10, 20, 20).timestamp()
+
+
+def test_quiet_hours_wrapping_midnight_shift_to_morning():
+    data = make_user(reminders={"quiet_hours": [19, 9]})
+    assert main.next_reminder_due("mood", data, at(2026, 10, 19, 12).timestamp()) == at(2026, 10, 20, 9).timestamp()
+    assert main.is_quiet_hour(23, [22, 8]) and main.is_quiet_hour(3, [22, 8])
+    assert not main.is_quiet_hour(12, [22, 8]) and not main.is_quiet_hour(12, [0, 0])
+
+
+def test_overdue_reminders_during_quiet_hours():
+    now_ts = at(2026, 10, 19, 23, 30).timestamp()
+    data = make_user(
+        profile_data={"last_updated": "2026-01-01"},
+        workout_diary=["18.10.2026 - Тренировка (Бег) выполнена! 💪 +15 очков."],
+    )
+
+    assert main.next_reminder_due("profile", data, now_ts) == at(2026, 10, 20, 8).timestamp()
+    assert main.next_reminder_due("mood", data, now_ts) == at(2026, 10, 20, 20).timestamp()
+    assert main.next_reminder_due("streak", data, now_ts) is None
+
+
+def test_overdue_profile_reminder_outside_quiet_hours_is_sent_now():
+    now_ts = at(2026, 10, 19, 15).timestamp()
+    data = make_user(profile_data={"last_updated": "2026-01-01"}, reminders={"last_sent": {"profile": "2026-10-10"}})
+    assert main.next_reminder_due("profile", data, now_ts) == now_ts
+
+    data["reminders"]["last_sent"]["profile"] = "2026-10-15"
+    assert main.next_reminder_due("profile", data, now_ts) == at(2026, 10, 22, 12).timestamp()
+
+
+def test_streak_reminder_rules():
+    now_ts = at(2026, 10, 19, 12).timestamp()
+    workout = " - Тренировка (Бег) выполнена! 💪 +15 очков."
+    data = make_user(workout_diary=["17.10.2026" + workout, "18.10.2026" + workout])
+
+    assert main.next_reminder_due("streak", data, now_ts) == at(2026, 10, 19, 19).timestamp()
+    assert main.get_workout_streak(data) == 2
+
+    data["workout_diary"].append("19.10.2026" + workout)
+    assert main.next_reminder_due("streak", data, now_ts) == at(2026, 10, 20, 19).timestamp()
+
+    data["workout_diary"] = ["15.10.2026" + workout]
+    assert main.next_reminder_due("streak", data, now_ts) is None
+
+    data["reminders"]["enabled"] = False
+    assert main.next_reminder_due("mood", data, now_ts) is None
+
+
+def store_due_profile_user(user_id, **overrides):
+    data = make_user(profile_data={"last_updated": "2020-01-01"}, reminders={"quiet_hours": [0, 0]}, **overrides)
+    main.save_user_data_to_db(user_id, data)
+
+
+def run_tick(send_message):
+    context = SimpleNamespace(bot=SimpleNamespace(send_message=send_message))
+    asyncio.run(main.process_due_reminders(context))
+
+
+def test_sent_reminder_is_recorded_and_rescheduled(queue):
+    store_due_profile_user("1")
+    queue.schedule("1", "profile", 0)
+    send_message = AsyncMock()
+
+    run_tick(send_message)
+
+    send_message.assert_awaited_once()
+    assert main.get_user_data_from_db("1")["reminders"]["last_sent"]["profile"]
+    assert queue._due[("1", "profile")] > time.time() + 6 * 86400
+
+
+def test_failures_requeue_reminders_without_marking_them_sent(queue):
+    store_due_profile_user("1")
+    store_due_profile_user("2")
+    store_due_profile_user("3")
+    bad = main.get_user_data_from_db("1")
+    bad["profile_data"]["last_updated"] = "не дата"
+    main.save_user_data_to_db("1", bad)
+    for user_id in ("1", "2", "3"):
+        queue.schedule(user_id, "profile", 0)
+
+    async def send_message(chat_id, **kwargs):
+        if chat_id == 3:
+            raise RetryAfter(30)
+        raise RuntimeError("network down")
+
+    started = time.time()
+    run_tick(send_message)
+
+    for user_id in ("1", "2"):
+        assert queue._due[(user_id, "profile")] >= started + main.REMINDER_RETRY_SECONDS
+    assert started + 29 <= queue._due[("3", "profile")] <= time.time() + 30
+    for user_id in ("2", "3"):
+        assert main.get_user_data_from_db(user_id)["reminders"]["last_sent"] == {}
+
+
+def test_blocked_user_gets_reminders_disabled(queue):
+    store_due_profile_user("1")
+    queue.schedule("1", "profile", 0)
+
+    run_tick(AsyncMock(side_effect=Forbidden("bot was blocked by the user")))
+
+    assert main.get_user_data_from_db("1")["reminders"]["enabled"] is False
+    assert len(queue) == 0
+
+
+def test_reminder_send_keeps_changes_saved_meanwhile(queue):
+    store_due_profile_user("1")
+    queue.schedule("1", "profile", 0)
+
+    async def send_message(chat_id, **kwargs):
+        data = main.get_user_data_from_db(chat_id)
+        data["score"] = 15
+        main.save_user_data_to_db(chat_id, data)
+
+    run_tick(send_message)
+
+    assert main.get_user_data_from_db("1")["score"] == 15
+
+
+def test_index_reminders_fills_queue_in_batches(queue, monkeypatch):
+    monkeypatch.setattr(main, "REMINDER_BATCH_SIZE", 2)
+    for user_id in ("11", "12", "13"):
+        main.db[user_id] = json.dumps({"first_name": "user"})
+    main.db["broadcast_state"] = json.dumps({"status": "done"})
+    job = SimpleNamespace(data=iter_users_data(main.db), schedule_removal=Mock())
+
+    asyncio.run(main.index_reminders(SimpleNamespace(job=job)))
+    assert len(queue) == 2
+    job.schedule_removal.assert_not_called()
+
+    asyncio.run(main.index_reminders(SimpleNamespace(job=job)))
+    assert len(queue) == 3
+    job.schedule_removal.assert_called_once()
@@ -0,0 +1,116 @@
+import asyncio
+import os
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "test-token")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+import main
+
+ROLE = "психотерапевт"
+# Системный промпт роли без сводки: роль, заглушка профиля и инструкции по стилю.
+SYSTEM_PROMPT_ALLOWANCE = 1000
+PROMPT_TOKEN_BOUND = SYSTEM_PROMPT_ALLOWANCE + main.CHAT_SUMMARY_MAX_TOKENS + main.CHAT_HISTORY_TOKEN_BUDGET + main.CHAT_MESSAGE_MAX_TOKENS
+
+
+class CharEncoding:
+    """Один символ — один токен: детерминированно и без загрузки словаря tiktoken."""
+
+    def encode(self, text):
+        return list(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+class StubChatClient:
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.chat_prompt_tokens = []
+        self.summary_calls = 0
+        self.fail_summaries = False
+
+    async def create(self, model, messages, max_tokens, temperature):
+        prompt_tokens = sum(main.count_tokens(message["content"]) for message in messages)
+        if messages[0]["role"] == "system":
+            self.chat_prompt_tokens.append(prompt_tokens)
+            content = "Это нормально, давай разберемся вместе. " * 5
+        else:
+            self.summary_calls += 1
+            if self.fail_summaries:
+                raise RuntimeError("summary failed")
+            content = "Пользователь спрашивает о тревоге перед сном. " * 3
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=prompt_tokens),
+        )
+
+
+@pytest.fixture
+def chat_client(monkeypatch):
+    client = StubChatClient()
+    monkeypatch.setattr(main, "db", {})
+    monkeypatch.setattr(main, "client", client)
+    monkeypatch.setattr(main, "get_chat_encoding", lambda: CharEncoding())
+    return client
+
+
+def run_chat_turns(turns, user_id=1):
+    data = main.get_user_data_from_db(user_id)
+    data["current_role"] = ROLE
+    data["context_state"] = "specialist_chat"
+    main.save_user_data_to_db(user_id, data)
+    for i in range(turns):
+        update = SimpleNamespace(
+            effective_user=SimpleNamespace(id=user_id),
+            effective_chat=SimpleNamespace(id=user_id),
+            message=SimpleNamespace(text=f"Вопрос {i}: как справиться с тревогой перед сном?", reply_text=AsyncMock()),
+        )
+        context = SimpleNamespace(bot=SimpleNamespace(send_chat_action=AsyncMock()))
+        asyncio.run(main.handle_specialist_chat(update, context, main.get_user_data_from_db(user_id)))
+    return main.get_user_data_from_db(user_id)["chat_history"][ROLE]
+
+
+def test_prompt_tokens_stay_flat(chat_client):
+    run_chat_turns(80)
+
+    tokens = chat_client.chat_prompt_tokens
+    assert len(tokens) == 80
+    assert chat_client.summary_calls > 0
+    assert max(tokens) <= PROMPT_TOKEN_BOUND
+    assert max(tokens[50:]) <= max(tokens[20:50])
+
+
+def test_failed_summary_keeps_turns(chat_client):
+    chat_client.fail_summaries = True
+    history = run_chat_turns(30)
+
+    assert chat_client.summary_calls > 0
+    assert history["summary"] == ""
+    assert len(history["turns"]) == 60
+    assert max(chat_client.chat_prompt_tokens) <= PROMPT_TOKEN_BOUND
+
+    chat_client.fail_summaries = False
+    history = run_chat_turns(1)
+
+    assert history["summary"]
+    assert len(history["turns"]) < 62
+
+
+def test_chat_turn_keeps_changes_saved_during_model_call(chat_client):
+    original_create = chat_client.create
+
+    async def create_while_reminder_fires(**kwargs):
+        data = main.get_user_data_from_db(1)
+        data["reminders"]["last_sent"]["mood"] = "2026-10-19"
+        main.save_user_data_to_db(1, data)
+        return await original_create(**kwargs)
+
+    chat_client.chat.completions.create = create_while_reminder_fires
+    history = run_chat_turns(1)
+
+    assert len(history["turns"]) == 2
+    assert main.get_user_data_from_db(1)["reminders"]["last_sent"] == {"mood": "2026-10-19"}